@@ -0,0 +1,86 @@
+#
+# Builds ranktable.bin, the perfect-hash rank table used by pokerhand.py
+#
+# Without a flush, the rank of a 7-card hand only depends on how many cards
+# of each value it holds. There are 49205 such combinations of values, each
+# identified by the product of the primes of its cards. This script ranks
+# every combination with 'handflags' and searches for a multiplier and
+# bucket displacements (see 'hashslot' in pokerhand.py) that send every
+# product to its own slot of a 64k-entry table.
+#
+# Execution:
+# $ python makeranktable.py
+#
+
+import itertools
+import random
+import struct
+
+from pokerhand import (STRAIGHT_FLUSH, FLUSH, SUITS, PRIMES, RANK_TABLE_FILE,
+                       RANK_TABLE_SIZE, RANK_BUCKETS, handmask, handflags, hashslot)
+
+# Returns the prime product and the rank of every combination of 7 values
+# with at most 4 cards per value
+def valuecombinations():
+    combinations = {}
+    for values in itertools.combinations_with_replacement(range(13), 7):
+        if any(values.count(v) > 4 for v in values):
+            continue
+        # The k-th card of a value gets the k-th suit, flushes are ignored
+        cards = [(SUITS[values[:i].count(v)], v + 1) for i, v in enumerate(values)]
+        flags = handflags(handmask(cards)) & ~((1 << STRAIGHT_FLUSH) | (1 << FLUSH))
+        product = 1
+        for v in values:
+            product *= PRIMES[v]
+        combinations[product] = (flags & -flags).bit_length() - 1
+    return combinations
+
+# Returns the displacement of each bucket for a multiplier, or None if some
+# bucket cannot be placed
+#   - buckets are placed largest first, each at the smallest displacement
+#     that moves all of its products to free slots
+def displacements(products, multiplier):
+    buckets = [[] for _ in range(RANK_BUCKETS)]
+    for product in products:
+        x = (product * multiplier) & 0xFFFFFFFFFFFFFFFF
+        buckets[(x >> 34) & (RANK_BUCKETS - 1)].append(x >> 48)
+
+    displacement = [0] * RANK_BUCKETS
+    used = bytearray(RANK_TABLE_SIZE)
+    for b in sorted(range(RANK_BUCKETS), key=lambda b: -len(buckets[b])):
+        if not buckets[b]:
+            break
+        for d in range(RANK_TABLE_SIZE):
+            slots = {(slot + d) & (RANK_TABLE_SIZE - 1) for slot in buckets[b]}
+            if len(slots) == len(buckets[b]) and not any(used[slot] for slot in slots):
+                break
+        else:
+            return None
+        displacement[b] = d
+        for slot in slots:
+            used[slot] = 1
+    return displacement
+
+# Searches a multiplier that gives a perfect hash and writes the table
+def makeranktable(path=RANK_TABLE_FILE, seed=0):
+    combinations = valuecombinations()
+    rng = random.Random(seed)
+    while True:
+        multiplier = rng.getrandbits(64) | 1
+        displacement = displacements(combinations, multiplier)
+        if displacement is not None:
+            break
+
+    table = bytearray(RANK_TABLE_SIZE)
+    for product, rank in combinations.items():
+        table[hashslot(product, multiplier, displacement)] = rank
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", multiplier))
+        f.write(struct.pack("<%dH" % RANK_BUCKETS, *displacement))
+        f.write(table)
+    print("Wrote " + str(len(combinations)) + " hands to " + path)
+
+
+if __name__ == "__main__":
+    makeranktable()
@@ -0,0 +1,205 @@
+#
+# Batched hand evaluation for Monte-Carlo simulations
+#
+# 'getRank' in pokerhand.py ranks one hand per Python call. For simulations
+# dealing many hands, this module ranks whole arrays of hands at once with
+# numpy, using the same 52-bit card masks as pokerhand.py: suit i occupies
+# bits 13*i .. 13*i+12 and value v of that suit sits at bit v-1, so the card
+# index used when dealing is also its bit position in the mask.
+#
+# This module contains the following components:
+#    1. rankhands: Given an array of 52-bit hand masks, returns the array of
+#       their ranks, compiled with numba when it is installed
+#    2. dealhands: Deals cards for a number of players over many trials and
+#       returns the hand mask of each player in each trial
+#    3. simulate: Deals and ranks hands over many trials
+#    4. Tests ranking the test hands of pokerhand.py with each evaluator
+#    5. Simulation printing how often each hand occurs for 3 players
+#
+
+import numpy as np
+
+try:
+    from numba import njit, types
+    HAVE_NUMBA = True
+
+    # Signatures of 'rankmasksjit' for contiguous arrays of masks, writable or
+    # read-only (e.g. np.frombuffer or memory-mapped)
+    RANKMASKS_SIGNATURES = [
+        types.int8[:](types.uint64[::1]),
+        types.int8[:](types.Array(types.uint64, 1, "C", readonly=True))]
+except ImportError:
+    # numba is optional: without it the functions below stay plain Python
+    # and 'rankhands' uses the vectorized numpy evaluator
+    HAVE_NUMBA = False
+    RANKMASKS_SIGNATURES = None
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+from pokerhand import (STRAIGHT_FLUSH, FOUR_KIND, FULL_HOUSE, FLUSH, STRAIGHT,
+                       THREE_KIND, TWO_PAIR, ONE_PAIR, HIGH_CARD, HAND_NAMES,
+                       ROW_BITS, ACE_HIGH_BIT, TESTHANDS, handmask)
+from pokerhand import POPCNT13 as POPCNT13_BYTES
+
+# Random generator used for dealing cards
+RNG = np.random.default_rng()
+
+# Number of cards in each possible 13-bit suit row, as a numpy array
+POPCNT13 = np.frombuffer(POPCNT13_BYTES, dtype=np.uint8)
+
+# Checks each 13-bit value mask in an array for 5 consecutive values
+#   - the ace bit is copied above King so both ace straights are found
+def straights(valuemasks):
+    m = valuemasks | ((valuemasks & 1) << ACE_HIGH_BIT)
+    return (m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)) != 0
+
+
+# Number of cards in a 13-bit suit row, counted in parallel bit fields
+@njit(cache=True)
+def popcount13(row):
+    row = row - ((row >> 1) & 0x5555)
+    row = (row & 0x3333) + ((row >> 2) & 0x3333)
+    row = (row + (row >> 4)) & 0x0F0F
+    return (row + (row >> 8)) & 0x1F
+
+
+# Checks a 13-bit value mask for 5 consecutive values, with the ace bit
+# copied above King
+@njit(cache=True)
+def isstraightrow(valuemask):
+    m = valuemask | ((valuemask & 1) << ACE_HIGH_BIT)
+    return (m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)) != 0
+
+
+# Returns the rank of one 52-bit hand mask, same as 'rankmask' in pokerhand.py
+# but written with integer operations only so that numba can compile it.
+# The signatures make numba compile it once, at import, for uint64 masks.
+@njit("int8(uint64)", cache=True)
+def rankmaskjit(hand):
+    h = np.int64(hand)
+    s0 = h & ROW_BITS
+    s1 = (h >> 13) & ROW_BITS
+    s2 = (h >> 26) & ROW_BITS
+    s3 = (h >> 39) & ROW_BITS
+    twos = (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3)
+    threes = (s0 & s1 & (s2 | s3)) | (s2 & s3 & (s0 | s1))
+    istwopair = (twos & (twos - 1)) != 0
+
+    if isstraightrow(s0) or isstraightrow(s1) or isstraightrow(s2) or isstraightrow(s3):
+        return STRAIGHT_FLUSH
+    if s0 & s1 & s2 & s3:
+        return FOUR_KIND
+    if threes and istwopair:
+        return FULL_HOUSE
+    if popcount13(s0) >= 5 or popcount13(s1) >= 5 or popcount13(s2) >= 5 or popcount13(s3) >= 5:
+        return FLUSH
+    if isstraightrow(s0 | s1 | s2 | s3):
+        return STRAIGHT
+    if threes:
+        return THREE_KIND
+    if istwopair:
+        return TWO_PAIR
+    if twos:
+        return ONE_PAIR
+    return HIGH_CARD
+
+
+# Ranks an array of hand masks one at a time with the compiled 'rankmaskjit'
+@njit(RANKMASKS_SIGNATURES, cache=True)
+def rankmasksjit(hands):
+    ranks = np.empty(hands.shape[0], dtype=np.int8)
+    for i in range(hands.shape[0]):
+        ranks[i] = rankmaskjit(hands[i])
+    return ranks
+
+
+# Ranks a 1-D array of hand masks with every rank test running as a
+# vectorized numpy operation over all hands
+def rankhandsnumpy(flat):
+    # One 13-bit row per suit, and the masks of values held at least
+    # 1, 2, 3 and 4 times from a bitwise full adder over the rows
+    rows = np.stack([((flat >> np.uint64(13 * i)) & np.uint64(ROW_BITS)).astype(np.int32)
+                     for i in range(4)])
+    s0, s1, s2, s3 = rows
+    ones = s0 | s1 | s2 | s3
+    twos = (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3)
+    threes = (s0 & s1 & (s2 | s3)) | (s2 & s3 & (s0 | s1))
+    fours = s0 & s1 & s2 & s3
+
+    # Fixed-size (4, N) uint8 array of the number of cards of each suit
+    countsbysuit = POPCNT13[rows]
+
+    isstraightflush = straights(rows).any(axis=0)
+    isflush = countsbysuit.max(axis=0) >= 5
+    istwopair = (twos & (twos - 1)) != 0
+
+    # First matching condition gives the rank, same order as 'getRank'
+    conditions = [isstraightflush, fours != 0, (threes != 0) & istwopair, isflush,
+                  straights(ones), threes != 0, istwopair, twos != 0]
+    ranks = [STRAIGHT_FLUSH, FOUR_KIND, FULL_HOUSE, FLUSH,
+             STRAIGHT, THREE_KIND, TWO_PAIR, ONE_PAIR]
+    return np.select(conditions, ranks, HIGH_CARD).astype(np.int8)
+
+
+# Returns the rank of each hand in an array of 52-bit hand masks, as an
+# array of the same shape
+#   - with numba installed the compiled 'rankmasksjit' is used, otherwise
+#     'rankhandsnumpy'
+def rankhands(hands):
+    hands = np.asarray(hands, dtype=np.uint64)
+    flat = np.ascontiguousarray(hands).ravel()
+    if HAVE_NUMBA:
+        return rankmasksjit(flat).reshape(hands.shape)
+    return rankhandsnumpy(flat).reshape(hands.shape)
+
+
+# Deals 2 cards to each player and 5 on the table in each trial and returns
+# a (numTrials, numPlayers) array of the players' 7-card hand masks
+#   - at most 23 players can be dealt from the 52-card deck, as in 'dealCards'
+def dealhands(numPlayers=1, numTrials=1):
+    numCards = 2 * numPlayers + 5
+    if numCards > 52:
+        raise ValueError("Cannot deal 2 cards to " + str(numPlayers) + " players and 5 on the table")
+    decks = RNG.permuted(np.tile(np.arange(52, dtype=np.uint64), (numTrials, 1)), axis=1)
+    cards = np.uint64(1) << decks[:, :numCards]
+
+    table = np.bitwise_or.reduce(cards[:, 2 * numPlayers:], axis=1)
+    return cards[:, 0:2 * numPlayers:2] | cards[:, 1:2 * numPlayers:2] | table[:, None]
+
+
+# Deals and ranks hands for a number of players over many trials, and
+# returns the (numTrials, numPlayers) array of ranks
+def simulate(numPlayers=1, numTrials=1):
+    return rankhands(dealhands(numPlayers, numTrials))
+
+
+# Test the ranks of the test hands of pokerhand.py, ranked in one batch by
+# the given evaluator
+def runtest(name, evaluate):
+    masks = np.array([handmask(pc + tc) for pc, tc, _ in TESTHANDS], dtype=np.uint64)
+    for (pc, tc, expected), rank in zip(TESTHANDS, evaluate(masks)):
+        print("TEST: " + name + " " + HAND_NAMES[expected])
+        if rank == expected:
+            print("SUCCESS")
+        else:
+            print("ERROR: TEST FAILED: " + name + " " + HAND_NAMES[expected])
+
+
+if __name__ == "__main__":
+
+    # Test both batched evaluators
+    runtest("numpy", rankhandsnumpy)
+    if HAVE_NUMBA:
+        runtest("numba", rankmasksjit)
+
+    print("\n\n")
+
+    # Simulation:
+    # Deal many games of 3 players and report how often each hand occurs
+
+    numTrials = 100000
+    print("SIMULATION: " + str(numTrials) + " games of 3 players")
+    counts = np.bincount(simulate(3, numTrials).ravel(), minlength=len(HAND_NAMES))
+    for rank, name in enumerate(HAND_NAMES):
+        print(name + ": " + str(counts[rank]))
@@ -0,0 +1,169 @@
+#
+# Hand evaluation and Monte-Carlo simulation on a CUDA GPU
+#
+# Every hand is an independent 52-bit card mask (see pokerhand.py), so the
+# evaluator runs with one GPU thread per hand. The kernels are compiled at
+# import time through CuPy, which must be installed along with a CUDA GPU.
+#
+# This module contains the following components:
+#    1. rankhandsgpu: Given an array of 52-bit hand masks, returns the array of
+#       their ranks
+#    2. simulategpu: Deals and ranks hands for a number of players over many
+#       trials, dealing the cards on the GPU as well
+#    3. Simulation printing how often each hand occurs for 3 players
+#
+
+import random
+
+import cupy as cp
+import numpy as np
+
+from pokerhand import (STRAIGHT_FLUSH, FOUR_KIND, FULL_HOUSE, FLUSH, STRAIGHT,
+                       THREE_KIND, TWO_PAIR, ONE_PAIR, HIGH_CARD, HAND_NAMES,
+                       ACE_HIGH_BIT)
+
+# Threads per block for both kernels
+BLOCK_SIZE = 256
+
+# Rank values and the ace bit shared with pokerhand.py
+RANK_DEFINES = "".join("#define %s %d\n" % item for item in [
+    ("ACE_HIGH_BIT", ACE_HIGH_BIT),
+    ("STRAIGHT_FLUSH", STRAIGHT_FLUSH), ("FOUR_KIND", FOUR_KIND),
+    ("FULL_HOUSE", FULL_HOUSE), ("FLUSH", FLUSH), ("STRAIGHT", STRAIGHT),
+    ("THREE_KIND", THREE_KIND), ("TWO_PAIR", TWO_PAIR),
+    ("ONE_PAIR", ONE_PAIR), ("HIGH_CARD", HIGH_CARD)])
+
+KERNEL_SOURCE = RANK_DEFINES + r'''
+#define ROW_BITS 0x1FFFULL
+
+// Checks a 13-bit value mask for 5 consecutive values, with the ace bit
+// copied above King
+__device__ bool isstraight(unsigned long long valuemask) {
+    unsigned long long m = valuemask | ((valuemask & 1) << ACE_HIGH_BIT);
+    return (m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)) != 0;
+}
+
+// Returns the rank of the best hand in a 52-bit hand mask, same as
+// 'rankmask' in pokerhand.py
+__device__ signed char rankmask(unsigned long long hand) {
+    unsigned long long s0 = hand & ROW_BITS;
+    unsigned long long s1 = (hand >> 13) & ROW_BITS;
+    unsigned long long s2 = (hand >> 26) & ROW_BITS;
+    unsigned long long s3 = (hand >> 39) & ROW_BITS;
+    unsigned long long twos = (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3);
+    unsigned long long threes = (s0 & s1 & (s2 | s3)) | (s2 & s3 & (s0 | s1));
+    bool istwopair = (twos & (twos - 1)) != 0;
+
+    if (isstraight(s0) || isstraight(s1) || isstraight(s2) || isstraight(s3))
+        return STRAIGHT_FLUSH;
+    if (s0 & s1 & s2 & s3)
+        return FOUR_KIND;
+    if (threes && istwopair)
+        return FULL_HOUSE;
+    if (__popcll(s0) >= 5 || __popcll(s1) >= 5 || __popcll(s2) >= 5 || __popcll(s3) >= 5)
+        return FLUSH;
+    if (isstraight(s0 | s1 | s2 | s3))
+        return STRAIGHT;
+    if (threes)
+        return THREE_KIND;
+    if (istwopair)
+        return TWO_PAIR;
+    if (twos)
+        return ONE_PAIR;
+    return HIGH_CARD;
+}
+
+// One thread per hand, with 64-bit indices so that more than 2^31 hands fit
+extern "C" __global__ void evaluate_hands(const unsigned long long* hands,
+                                          signed char* ranks, long long n) {
+    long long i = (long long)blockIdx.x * blockDim.x + threadIdx.x;
+    if (i < n)
+        ranks[i] = rankmask(hands[i]);
+}
+
+// Next number of a per-thread splitmix64 generator
+__device__ unsigned long long nextrandom(unsigned long long* state) {
+    unsigned long long z = (*state += 0x9E3779B97F4A7C15ULL);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+// One thread per trial: shuffles the first 2*numPlayers+5 cards of its own
+// deck with Fisher-Yates, then ranks the 7-card hand of every player
+extern "C" __global__ void simulate_hands(unsigned long long seed, int numPlayers,
+                                          signed char* ranks, long long numTrials) {
+    long long i = (long long)blockIdx.x * blockDim.x + threadIdx.x;
+    if (i >= numTrials)
+        return;
+
+    unsigned long long state = seed ^ ((unsigned long long)i * 0xD1B54A32D192ED03ULL);
+    unsigned char deck[52];
+    for (int k = 0; k < 52; k++)
+        deck[k] = k;
+
+    int numCards = 2 * numPlayers + 5;
+    for (int k = 0; k < numCards; k++) {
+        int j = k + (int)(nextrandom(&state) % (unsigned long long)(52 - k));
+        unsigned char card = deck[k];
+        deck[k] = deck[j];
+        deck[j] = card;
+    }
+
+    unsigned long long table = 0;
+    for (int k = 2 * numPlayers; k < numCards; k++)
+        table |= 1ULL << deck[k];
+    for (int p = 0; p < numPlayers; p++) {
+        unsigned long long hand = table | (1ULL << deck[2 * p]) | (1ULL << deck[2 * p + 1]);
+        ranks[i * numPlayers + p] = rankmask(hand);
+    }
+}
+'''
+
+MODULE = cp.RawModule(code=KERNEL_SOURCE)
+EVALUATE_HANDS = MODULE.get_function("evaluate_hands")
+SIMULATE_HANDS = MODULE.get_function("simulate_hands")
+
+
+# Returns the rank of each hand in an array of 52-bit hand masks, as an
+# array of the same shape
+#   - the kernel reads the raw buffer, so the masks are made contiguous first
+def rankhandsgpu(hands):
+    hands = cp.asarray(hands, dtype=cp.uint64)
+    if hands.size == 0:
+        return np.empty(hands.shape, dtype=np.int8)
+    flat = cp.ascontiguousarray(hands).ravel()
+    n = flat.size
+    ranks = cp.empty(n, dtype=cp.int8)
+    numBlocks = (n + BLOCK_SIZE - 1) // BLOCK_SIZE
+    EVALUATE_HANDS((numBlocks,), (BLOCK_SIZE,), (flat, ranks, np.int64(n)))
+    return cp.asnumpy(ranks).reshape(hands.shape)
+
+
+# Deals and ranks hands for a number of players over many trials on the GPU,
+# and returns the (numTrials, numPlayers) array of ranks
+#   - each thread shuffles a 52-card deck, so at most 23 players can be dealt
+def simulategpu(numPlayers=1, numTrials=1, seed=None):
+    if 2 * numPlayers + 5 > 52:
+        raise ValueError("Cannot deal 2 cards to " + str(numPlayers) + " players and 5 on the table")
+    if numTrials == 0 or numPlayers == 0:
+        return np.empty((numTrials, numPlayers), dtype=np.int8)
+    if seed is None:
+        seed = random.getrandbits(64)
+    ranks = cp.empty((numTrials, numPlayers), dtype=cp.int8)
+    numBlocks = (numTrials + BLOCK_SIZE - 1) // BLOCK_SIZE
+    SIMULATE_HANDS((numBlocks,), (BLOCK_SIZE,),
+                   (np.uint64(seed), np.int32(numPlayers), ranks, np.int64(numTrials)))
+    return cp.asnumpy(ranks)
+
+
+if __name__ == "__main__":
+
+    # Simulation:
+    # Deal many games of 3 players on the GPU and report how often each hand occurs
+
+    numTrials = 10000000
+    print("SIMULATION: " + str(numTrials) + " games of 3 players")
+    counts = np.bincount(simulategpu(3, numTrials).ravel(), minlength=len(HAND_NAMES))
+    for rank, name in enumerate(HAND_NAMES):
+        print(name + ": " + str(counts[rank]))
@@ -32,18 +32,23 @@
 # This code sample contains the following components: 
 #    1. getRank: Given  a list of 5 table cards and a list of 2 player cards, 
 #       this returns the rank of the best hand possible for that player
-#    2. dealCards : Given a number of players, this function returns the list of table cards 
+#    2. handflags: Given a 52-bit mask of a hand, returns a bitfield of every hand
+#       from the list above that it contains
+#    3. boardranks: Given a list of 5 table cards, returns a lookup table of the rank
+#       for every possible pair of player cards
+#    4. dealCards : Given a number of players, this function returns the list of table cards 
 #    and list of lists of player cards
-#    3. Unit tests to make sure 'getRank' returns correct rank for each possible hand from above list
-#    4. Simulation to deal cards for 3 players, get their ranks and order them according to rank
+#    5. Unit tests to make sure 'getRank' returns correct rank for each possible hand from above list
+#    6. Simulation to deal cards for 3 players, get their ranks and order them according to rank
 # Note: For now, the case where 2 players have same rank and the tie-break depends on 
 # the values of cards in their hand is not handled. For example, a hand with pair of 3s and hand with pair of 
 # 10s currently will have the same rank
 #
 
-import itertools # For generating deck of cards using cartesian product 
+import functools # For caching ranks of hands
+import os # For locating the rank table next to this file
 import random # For dealing cards
-import numpy as np
+import struct # For reading the rank table
 
 # Suit names
 S = 'Spade'
@@ -70,140 +75,275 @@ HAND_NAMES = ["Straight_flush", "Four_kind", "Full_House", "Flush", "Straight",
 ACE_LOW = 1
 ACE_HIGH = 14
 
-# Checks if a given set of card values contains 5 consecutive values
+# Cards are encoded as single bits of a 52-bit integer: suit i occupies
+# bits 13*i .. 13*i+12 and, within a suit row, value v sits at bit v-1.
+# Ace always lives in the lowest bit of its row, whether given as 1 or 14.
+SUITS = [S, H, C, D]
+SUIT_INDEX = {S: 0, H: 1, C: 2, D: 3}
+ROW_BITS = 0x1FFF # 13 bits, one per value of a suit
+
+# For straights the ace also counts above King: its bit is always copied from
+# bit 0 to ACE_HIGH_BIT, so no test ever branches on whether an ace is present
+ACE_HIGH_BIT = ACE_HIGH - 1
+
+# Returns a 13-bit value mask with the ace also set above King
+def acehigh(valuemask):
+    return valuemask | ((valuemask & 1) << ACE_HIGH_BIT)
+
+# Bit position (0-51) and bit of every card in the 52-bit mask, for values 1-14
+CARD_INDEX = {(suit, value): SUIT_INDEX[suit] * 13 + (value - 1) % 13
+              for suit in SUITS for value in range(ACE_LOW, ACE_HIGH + 1)}
+CARD_BITS = {card: 1 << index for card, index in CARD_INDEX.items()}
+
+# Returns the 52-bit mask with one bit set for each card in the list
+def handmask(cards):
+    mask = 0
+    for card in cards:
+        mask |= CARD_BITS[card]
+    return mask
+
+# Returns the highest value (5-14) of a straight in a 13-bit value mask, or 0
 #   - Ace can form 2 straights: (Ace 2 3 4 5) and (10 Jack Queen King Ace)
-def isstraight(values):
-    if ACE_LOW in values:
-        values.append(ACE_HIGH)
-    values.sort()
-    prevval = values[0]
-    count = 1
-    for value in values[1:]:
-        if value - prevval == 1:
-            count +=1
-        else:
-            count = 1       
-        if count == 5:
-            break
-        prevval = value 
-    if count == 5:
-        return True
-    else:
-        return False
-            
-# Checks if a given hand contains a straight flush by checking the following conditions:
-#        - it contains a flush (at least 5 cards of same suit)
-#        - the cards from same suit contain a straight
-        
-def isstraightflush(countsbysuit, cardsbysuit):
-    max_suit = max(countsbysuit, key=countsbysuit.get)
-    if countsbysuit[max_suit] < 5:
-        return False
-    else:
-        return isstraight(cardsbysuit[max_suit])
+#   - bit i of 'runs' is set when bits i..i+4 are all set, so the highest
+#     set bit of 'runs' is the lowest card of the best straight
+def straighthigh(valuemask):
+    m = acehigh(valuemask)
+    runs = m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)
+    return runs.bit_length() + 4 * (runs != 0)
 
+# Highest straight value for every possible 13-bit value mask, built once
+STRAIGHT_TABLE = bytearray(straighthigh(m) for m in range(1 << 13))
+
+# Number of cards in every possible 13-bit suit row, built once (8 KiB)
+POPCNT13 = bytes(m.bit_count() for m in range(1 << 13))
+
+# Checks if a 13-bit value mask contains 5 consecutive values
+def isstraight(valuemask):
+    return STRAIGHT_TABLE[valuemask] != 0
 
 # Checks if a hand is a full house by making sure that the following conditions are met:
-#        -if there is one set of 3 cards with same values:
-#        -if there is another set of 2/3 cards with same values
-# The second condition can also be formutaed as: there are at most 2 values with count = 1      
-def isfullhouse(countsbyvalue):
-    _isfullhouse = False
-    if 3 in countsbyvalue.values():
-        count_ones = 0
-        for count in countsbyvalue.values():
-            if count == 1:
-                count_ones += 1
-        if count_ones <=2:
-            _isfullhouse = True
-    return _isfullhouse
-    
-    
+#        -if there is one value with 3 cards
+#        -if there is another value with 2/3 cards
+# 'twos' and 'threes' are masks of the values held at least 2 and 3 times,
+# so the second condition is: 'twos' has more than one bit set
+def isfullhouse(twos, threes):
+    return threes != 0 and twos.bit_count() >= 2
+
+
+# Splits a 52-bit hand mask into one 13-bit row per suit and counts how many
+# suits hold each value with a bitwise full adder over the 4 rows: bit v of
+# 'twos' is set if value v+1 occurs at least twice, and so on.
+# Returns (suitrows, ones, twos, threes, fours)
+def splithand(hand):
+    s0 = hand & ROW_BITS
+    s1 = (hand >> 13) & ROW_BITS
+    s2 = (hand >> 26) & ROW_BITS
+    s3 = (hand >> 39) & ROW_BITS
+    return ((s0, s1, s2, s3),
+            s0 | s1 | s2 | s3,
+            (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3),
+            (s0 & s1 & (s2 | s3)) | (s2 & s3 & (s0 | s1)),
+            s0 & s1 & s2 & s3)
+
+
+# Returns a bitfield of every hand from list above contained in a 52-bit mask
+# of 7 cards: bit r is set if the hand holds the hand with rank r. High card
+# is always present. Callers can test e.g. 'flags & (1 << STRAIGHT)' without
+# evaluating the hand again.
+def handflags(hand):
+    suitrows, ones, twos, threes, fours = splithand(hand)
+
+    # Only one suit can hold 5 of the 7 cards, so a single pass over the rows
+    # finds the flush, and a straight flush must be a straight in that row
+    flushrow = 0
+    for row in suitrows:
+        if POPCNT13[row] >= 5:
+            flushrow = row
+
+    # Every hand is tested independently and sets its own bit
+    return ((isstraight(flushrow) << STRAIGHT_FLUSH)
+            | ((fours != 0) << FOUR_KIND)
+            | (isfullhouse(twos, threes) << FULL_HOUSE)
+            | ((flushrow != 0) << FLUSH)
+            | (isstraight(ones) << STRAIGHT)
+            | ((threes != 0) << THREE_KIND)
+            | ((twos.bit_count() >= 2) << TWO_PAIR)
+            | ((twos != 0) << ONE_PAIR)
+            | (1 << HIGH_CARD))
+
+
+# Returns the rank from list above of the best hand in a 52-bit hand mask
+#   - the best hand has the lowest rank, i.e. the lowest set bit of the flags
+def rankfromflags(hand):
+    flags = handflags(hand)
+    return (flags & -flags).bit_length() - 1
+
+
+# Prime number for each value (Ace = 2, ..., King = 41): the product of the
+# primes of all cards identifies the values in a hand, whatever the suits
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+
+# Returns the prime product of every possible 13-bit value mask: each mask
+# is the mask without its lowest value times the prime of that value
+def primeproducts():
+    products = [1] * (1 << 13)
+    for m in range(1, 1 << 13):
+        products[m] = products[m & (m - 1)] * PRIMES[(m & -m).bit_length() - 1]
+    return products
+
+# Prime product of every possible 13-bit value mask, built once
+PRIME_PRODUCT = primeproducts()
+
+# Ranks of 7-card hands without a flush, by the prime product of their values.
+# The table is built offline by makeranktable.py and stored in ranktable.bin
+# as a 64-bit multiplier, RANK_BUCKETS 16-bit displacements and RANK_TABLE_SIZE
+# ranks. A prime product is hashed to its slot in two steps:
+#   - the top 16 bits of product * multiplier give a first slot
+#   - the next 14 bits pick a bucket, whose displacement moves all products
+#     of that bucket to free slots, so no two hands share a slot
+RANK_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ranktable.bin")
+RANK_TABLE_SIZE = 1 << 16
+RANK_BUCKETS = 1 << 14
+
+# Returns the slot of a prime product in the rank table
+def hashslot(product, multiplier, displacement):
+    x = (product * multiplier) & 0xFFFFFFFFFFFFFFFF
+    return ((x >> 48) + displacement[(x >> 34) & (RANK_BUCKETS - 1)]) & (RANK_TABLE_SIZE - 1)
+
+# Returns the multiplier, the displacements and the ranks stored in a rank table file
+def loadranktable(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    multiplier, = struct.unpack_from("<Q", data)
+    displacement = struct.unpack_from("<%dH" % RANK_BUCKETS, data, 8)
+    return multiplier, displacement, data[8 + 2 * RANK_BUCKETS:]
+
+# Returns the rank from list above of the best hand in a 52-bit hand mask
+#   - the table only holds 7-card hands, other hands are classified with
+#     their flags
+#   - with 5 cards of one suit, the 2 other cards cannot make a four of a kind
+#     or a full house, so a flush is only beaten by a straight flush
+#   - otherwise the rank only depends on the values and is read from the table
+def ranklookup(hand):
+    if hand.bit_count() != 7:
+        return rankfromflags(hand)
+    suitrows, ones, twos, threes, fours = splithand(hand)
+    for row in suitrows:
+        if POPCNT13[row] >= 5:
+            return STRAIGHT_FLUSH if STRAIGHT_TABLE[row] else FLUSH
+
+    product = PRIME_PRODUCT[ones] * PRIME_PRODUCT[twos] * PRIME_PRODUCT[threes] * PRIME_PRODUCT[fours]
+    return RANK_TABLE[hashslot(product, RANK_MULTIPLIER, RANK_DISPLACEMENT)]
+
+try:
+    RANK_MULTIPLIER, RANK_DISPLACEMENT, RANK_TABLE = loadranktable(RANK_TABLE_FILE)
+    rankmask = ranklookup
+except FileNotFoundError:
+    # The table has not been built yet, classify hands with their flags
+    rankmask = rankfromflags
+
+
+# Use the compiled 'rankmask' from pokerhand_core.pyx when it has been built
+try:
+    from pokerhand_core import rankmask
+except ImportError:
+    pass
+
 
 # Returns the rank of the card from list above given 5 table cards and 2 player cards
-def getRank(playercards, tablecards): 
-    fullhand = tablecards + playercards
-    
-    # Preprocess to generate 3 data structures: 
-    # - dictionary of list of cards by suits
-    # - dictionary of number of cards for each value
-    # - all cards sorted by value in descending order
-    
-    cardsbysuit = {} # cards from each suit
-    countsbysuit = {} # number of cards from each suit
-    countsbyvalue = {} # number of cards of each value 
-    for suit, value in fullhand:     
-        if suit in cardsbysuit:
-            cardsbysuit[suit].append(value)
-            countsbysuit[suit] += 1
-        else:
-            cardsbysuit[suit] = [value]
-            countsbysuit[suit] = 1          
-        if value in countsbyvalue:
-            countsbyvalue[value] += 1
-        else:
-            countsbyvalue[value] = 1
-    
-    # Check each hand in ascending order of rank
-    if isstraightflush(countsbysuit, cardsbysuit):
-        # check if straight flush exists
-        rank = STRAIGHT_FLUSH
-    elif 4 in countsbyvalue.values():
-        # checks if any value occurs 4 times
-        rank = FOUR_KIND
-    elif isfullhouse(countsbyvalue):
-        # checks if there exists a value with 3 cards and another value with 2 cards
-        rank = FULL_HOUSE
-    elif max(countsbysuit.values()) >= 5:
-        # checks if any suit has 5 or higher number of cards in the set of 7
-        rank = FLUSH
-    elif isstraight(list(countsbyvalue.keys())):
-        # checks if any 5 cards have consecutive values
-        rank = STRAIGHT
-    elif 3 in countsbyvalue.values():
-        # checks if any value occurs 3 times
-        rank = THREE_KIND
-    elif 2 in countsbyvalue.values():
-        numpairs = 0
-        for count in countsbyvalue.values():
-            if count == 2:
-                numpairs += 1
-        if numpairs >= 2:
-            # More than 1 pair detected
-            rank = TWO_PAIR
-        else: 
-            # Exactly 1 pair detected
-            rank = ONE_PAIR
-    else:
-        # No other combination exists
-        rank = HIGH_CARD
-    
-    return rank
+#   - a full hand is 2 + 5 cards, so its mask is built without a loop; hands
+#     with fewer table cards (e.g. after the flop) go through 'handmask'
+#   - the numba 'rankmaskjit' stays in pokerbatch.py: importing numba here
+#     would cost far more than one game saves, and the compiled per-call
+#     path is the Cython 'rankmask' above
+def getRank(playercards, tablecards):
+    if len(playercards) != 2 or len(tablecards) != 5:
+        return rankmask(handmask(tablecards + playercards))
+    p0, p1 = playercards
+    t0, t1, t2, t3, t4 = tablecards
+    return rankmask(CARD_BITS[p0] | CARD_BITS[p1] | CARD_BITS[t0] | CARD_BITS[t1]
+                    | CARD_BITS[t2] | CARD_BITS[t3] | CARD_BITS[t4])
+
 
+# Same as 'rankmask', remembering the ranks of recently seen hands
+rankmaskcached = functools.lru_cache(maxsize=1 << 20)(rankmask)
+
+# Entry of a 'boardranks' table for player cards that cannot be dealt
+NO_RANK = 0xFF
+
+# Returns the rank of every pair of player cards for the given 5 table cards,
+# for repeated evaluation on a fixed table (e.g. trying many player cards)
+#   - entry 52 * i + j is the rank for the player cards with CARD_INDEX i and j
+#   - entries for a card on the table or i == j are NO_RANK
+def boardranks(tablecards):
+    board = handmask(tablecards)
+    ranks = bytearray([NO_RANK]) * (52 * 52)
+    free = [i for i in range(52) if not board >> i & 1]
+    for a, i in enumerate(free):
+        for j in free[a + 1:]:
+            ranks[52 * i + j] = ranks[52 * j + i] = rankmask(board | (1 << i) | (1 << j))
+    return ranks
+
+
+# Deck of 52 cards, built once
+DECK = [(suit, value) for suit in SUITS for value in range(ACE_LOW, ACE_HIGH)]
 
 # Randomly deals 2 cards to each player and 5 on the table
+#   - one sample of distinct cards from the deck covers all players and the table
 def dealCards(numPlayers=1):
+    cards = random.sample(DECK, 2 * numPlayers + 5)
 
-    suits = [S, H, C, D]
-    values = list(range(ACE_LOW, ACE_HIGH))
-    deck = itertools.product(suits, values)
-    deck = set(deck) # random.sample needs set input
-    
-    playercards = []
-    for _ in range(numPlayers):
-        cards = random.sample(deck, 2)
-        for card in cards:
-            deck.remove(card) 
-        playercards.append(cards)
-    
-    tablecards = random.sample(deck, 5)
-    for card in tablecards:
-        deck.remove(card)
+    playercards = [cards[2 * p:2 * p + 2] for p in range(numPlayers)]
+    tablecards = cards[2 * numPlayers:]
 
     return (playercards, tablecards,)
 
 # Test each type of hand:
 
+# Hands used by the tests: (player cards, table cards, expected rank)
+TESTHANDS = [
+    # Straight Flush
+    ([(S, 3), (S, 7)],
+     [(D, 2), (S, 4), (S, 5), (C, 13), (S, 6)], STRAIGHT_FLUSH),
+    # Four of a kind
+    ([(S, 3), (H, 3)],
+     [(D, 3), (S, 4), (S, 5), (C, 3), (S, 6)], FOUR_KIND),
+    # Full House
+    ([(S, 3), (H, 3)],
+     [(D, 3), (S, 14), (S, 5), (C, 5), (C, 11)], FULL_HOUSE),
+    # Flush
+    ([(S, 11), (H, 3)],
+     [(S, 3), (S, 4), (S, 5), (C, 12), (S, 6)], FLUSH),
+    # Straight
+    ([(S, 10), (D, 8)],
+     [(H, 9), (S, 4), (S, 5), (C, 12), (H, 11)], STRAIGHT),
+    # Straight with Ace low (Ace 2 3 4 5)
+    ([(S, 1), (D, 3)],
+     [(H, 2), (S, 4), (C, 5), (C, 12), (H, 11)], STRAIGHT),
+    # Straight with Ace high (10 Jack Queen King Ace), Ace given as 14
+    ([(S, 14), (D, 13)],
+     [(H, 2), (S, 10), (C, 11), (C, 12), (H, 5)], STRAIGHT),
+    # Three of a kind
+    ([(S, 10), (D, 5)],
+     [(H, 9), (S, 4), (S, 5), (C, 12), (H, 5)], THREE_KIND),
+    # Two Pair
+    ([(S, 10), (D, 5)],
+     [(H, 9), (S, 4), (S, 5), (C, 12), (H, 10)], TWO_PAIR),
+    # One pair
+    ([(S, 10), (D, 5)],
+     [(H, 9), (S, 4), (S, 7), (C, 12), (H, 10)], ONE_PAIR),
+    # High card
+    ([(S, 10), (D, 5)],
+     [(H, 2), (S, 4), (S, 7), (C, 12), (H, 3)], HIGH_CARD),
+    # High card after the flop (5 cards): ranked without the 7-card table
+    ([(S, 2), (H, 5)],
+     [(C, 9), (D, 11), (S, 13)], HIGH_CARD),
+    # Three of a kind after the turn (6 cards)
+    ([(S, 9), (H, 5)],
+     [(C, 9), (D, 11), (S, 13), (H, 9)], THREE_KIND),
+]
+
+
 def runtest(pc, tc, expected):
     name = HAND_NAMES[expected]
     print("TEST: " + name)
@@ -213,75 +353,57 @@ def runtest(pc, tc, expected):
     else:
         print("ERROR: TEST FAILED: "+ name)
 
+# Prints the result of a test that is not a single hand
+def runcheck(name, passed):
+    print("TEST: " + name)
+    if passed:
+        print("SUCCESS")
+    else:
+        print("ERROR: TEST FAILED: " + name)
+
+
+# Tests and simulation run only when this file is executed directly, so
+# that other modules can import the evaluator
+if __name__ == "__main__":
+
+    # Test each type of hand
+    for pc, tc, expected in TESTHANDS:
+        runtest(pc, tc, expected)
+
+    # Per-table ranks and cached ranks for a dealt hand must match 'getRank',
+    # and a player card already on the table has no rank
+    playercards, tablecards = dealCards(1)
+    pc = playercards[0]
+    expected = getRank(pc, tablecards)
+    ranks = boardranks(tablecards)
+    i, j = CARD_INDEX[pc[0]], CARD_INDEX[pc[1]]
+    runcheck("boardranks", ranks[52 * i + j] == ranks[52 * j + i] == expected
+             and ranks[52 * i + CARD_INDEX[tablecards[0]]] == NO_RANK)
+    hand = handmask(pc + tablecards)
+    hits = rankmaskcached.cache_info().hits
+    runcheck("rankmaskcached", rankmaskcached(hand) == rankmaskcached(hand) == expected
+             and rankmaskcached.cache_info().hits == hits + 1)
+
+    print("\n\n")
+
+
+    # Simulation:
+    # With randomly dealt hands, generate a ranking order for all players.
+    # As mentioned earlier We are currently not handling the case where 'rank' is 
+    # same for two players and the tie-breaker depends on the value of the cards 
+    # in their hand
+
+    print("SIMULATION: Multiplayer game")
+    playercards, tablecards = dealCards(3)
+    print("Table Cards")
+    print(tablecards)
+    ranks = []
+
+    for pc in playercards:
+        rank = getRank(pc, tablecards)
+        ranks.append(rank)
+    sorted_order = sorted(range(len(ranks)), key=ranks.__getitem__)
 
-# Straight Flush
-pc = [(S, 3), (S, 7)]
-tc = [(D, 2), (S, 4), (S, 5), (C, 13), (S, 6)]
-runtest(pc, tc, STRAIGHT_FLUSH)
-    
-    
-# Four of a kind
-pc = [(S, 3), (H, 3)]
-tc = [(D, 3), (S, 4), (S, 5), (C, 3), (S, 6)]
-runtest(pc, tc, FOUR_KIND)
-
-# Full House
-pc = [(S, 3), (H, 3)]
-tc = [(D, 3), (S, 14), (S, 5), (C, 5), (C, 11)]
-runtest(pc, tc, FULL_HOUSE)
-
-# Flush
-pc = [(S, 11), (H, 3)]
-tc = [(S, 3), (S, 4), (S, 5), (C, 12), (S, 6)]
-runtest(pc, tc, FLUSH)
-
-# Straight
-pc = [(S, 10), (D, 8)]
-tc = [(H, 9), (S, 4), (S, 5), (C, 12), (H, 11)]
-runtest(pc, tc, STRAIGHT)
-
-# Three of a kind
-pc = [(S, 10), (D, 5)]
-tc = [(H, 9), (S, 4), (S, 5), (C, 12), (H, 5)]
-runtest(pc, tc, THREE_KIND)
-
-# Two Pair
-pc = [(S, 10), (D, 5)]
-tc = [(H, 9), (S, 4), (S, 5), (C, 12), (H, 10)]
-runtest(pc, tc, TWO_PAIR)
-
-# One pair
-pc = [(S, 10), (D, 5)]
-tc = [(H, 9), (S, 4), (S, 7), (C, 12), (H, 10)]
-runtest(pc, tc, ONE_PAIR)
-
-# High card
-pc = [(S, 10), (D, 5)]
-tc = [(H, 2), (S, 4), (S, 7), (C, 12), (H, 3)]
-runtest(pc, tc, HIGH_CARD)
-
-print("\n\n")
-
-
-# Simulation:
-# With randomly dealt hands, generate a ranking order for all players.
-# As mentioned earlier We are currently not handling the case where 'rank' is 
-# same for two players and the tie-breaker depends on the value of the cards 
-# in their hand
-
-print("SIMULATION: Multiplayer game")
-playercards, tablecards = dealCards(3)
-print("Table Cards")
-print(tablecards)
-ranks = []
-
-for pc in playercards:
-    rank = getRank(pc, tablecards)
-    ranks.append(rank)
-sorted_order = np.argsort(np.array(ranks))
-
-for idx in list(sorted_order):
-    print("Player " + str(idx) + " has a " + HAND_NAMES[ranks[idx]])
-    print("Player " + str(idx) + " cards " + str(playercards[idx]))
-
-    
+    for idx in sorted_order:
+        print("Player " + str(idx) + " has a " + HAND_NAMES[ranks[idx]])
+        print("Player " + str(idx) + " cards " + str(playercards[idx]))
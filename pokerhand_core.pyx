@@ -0,0 +1,70 @@
+#
+# Compiled hand evaluator for pokerhand.py
+#
+# Same algorithm as 'rankmask' in pokerhand.py, typed with C integers so the
+# whole evaluation runs without Python objects. pokerhand.py imports it when
+# it has been built, and otherwise keeps its pure Python 'rankmask':
+#
+# $ cythonize -3 -i --annotate pokerhand_core.pyx
+#
+# The annotated pokerhand_core.html should show no Python interaction
+# (no yellow lines) inside 'rankmask'.
+#
+
+cdef extern from *:
+    int __builtin_popcountll(unsigned long long) nogil
+
+# Rank values for each hand, as in pokerhand.py
+cdef enum:
+    STRAIGHT_FLUSH = 0
+    FOUR_KIND = 1
+    FULL_HOUSE = 2
+    FLUSH = 3
+    STRAIGHT = 4
+    THREE_KIND = 5
+    TWO_PAIR = 6
+    ONE_PAIR = 7
+    HIGH_CARD = 8
+
+cdef unsigned long long ROW_BITS = 0x1FFF
+
+# Bit of the ace above King for straights, as in pokerhand.py
+cdef enum:
+    ACE_HIGH_BIT = 13
+
+
+# Checks a 13-bit value mask for 5 consecutive values, with the ace bit
+# copied above King
+cdef inline bint isstraight(unsigned long long valuemask) noexcept nogil:
+    cdef unsigned long long m = valuemask | ((valuemask & 1) << ACE_HIGH_BIT)
+    return (m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)) != 0
+
+
+# Returns the rank of the best hand in a 52-bit hand mask
+cpdef int rankmask(unsigned long long hand) noexcept nogil:
+    cdef unsigned long long s0 = hand & ROW_BITS
+    cdef unsigned long long s1 = (hand >> 13) & ROW_BITS
+    cdef unsigned long long s2 = (hand >> 26) & ROW_BITS
+    cdef unsigned long long s3 = (hand >> 39) & ROW_BITS
+    cdef unsigned long long twos = (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3)
+    cdef unsigned long long threes = (s0 & s1 & (s2 | s3)) | (s2 & s3 & (s0 | s1))
+    cdef bint istwopair = (twos & (twos - 1)) != 0
+
+    if isstraight(s0) or isstraight(s1) or isstraight(s2) or isstraight(s3):
+        return STRAIGHT_FLUSH
+    if s0 & s1 & s2 & s3:
+        return FOUR_KIND
+    if threes and istwopair:
+        return FULL_HOUSE
+    if (__builtin_popcountll(s0) >= 5 or __builtin_popcountll(s1) >= 5
+            or __builtin_popcountll(s2) >= 5 or __builtin_popcountll(s3) >= 5):
+        return FLUSH
+    if isstraight(s0 | s1 | s2 | s3):
+        return STRAIGHT
+    if threes:
+        return THREE_KIND
+    if istwopair:
+        return TWO_PAIR
+    if twos:
+        return ONE_PAIR
+    return HIGH_CARD